@@ -1,5 +1,6 @@
 from __future__ import annotations
-import json
+import asyncio
+import orjson
 from dataclasses import dataclass
 from typing import Any, Dict, List, Optional, Tuple
 
@@ -12,7 +13,10 @@ SYSTEM_PROMPT = """You are a SQL optimization agent for DuckDB.
 Rules:
 - Do NOT assume tables or columns. Use tools to check existence and schema.
 - If the query references relations not found in DuckDB catalog, ask the user for definitions or how they are created.
-- Use EXPLAIN and benchmark (EXPLAIN ANALYZE) to evaluate before/after.
+- Use EXPLAIN and benchmark (median execution time + EXPLAIN ANALYZE sample) to evaluate before/after.
+  Pass include_analyze=false to benchmark when you only need the timings.
+- When several rewrites are plausible, propose up to 4 candidates and compare them in one
+  benchmark_batch call instead of benchmarking them one by one.
 - When calling tools, pass raw SQL only. Never include backticks, markdown headings, or commentary in tool arguments.
 - Preserve semantics: do not add LIMIT, sampling, or approximations unless user explicitly allows.
 - Prefer rewrites that reduce scanned columns/rows and intermediate join cardinality:
@@ -21,12 +25,18 @@ Rules:
   - Pre-aggregate before joins when safe
   - Replace correlated subqueries with joins/CTEs
   - Deduplicate repeated subqueries
-- Output: provide the optimized SQL and a short rationale. Keep it concise.
+- Output: provide the optimized SQL (only the best candidate) and a short rationale. Keep it concise.
 
 Evaluation:
 - Compare median_ms from benchmark. Consider >=10% improvement meaningful.
 """
 
+# Tools whose output depends only on their arguments when the db is read-only
+# (only then is it cached); benchmarks are fresh measurements and always run.
+CACHEABLE_TOOLS = frozenset({"list_tables", "table_exists", "describe_relation", "explain"})
+# Tools that time query execution; running them side by side would skew their timings.
+TIMING_TOOLS = frozenset({"benchmark", "benchmark_batch"})
+
 @dataclass
 class AgentConfig:
     max_tool_steps: int = 30
@@ -37,8 +47,32 @@ class SQLAgent:
         self.tooling = tooling
         self.cfg = cfg
         self.messages: List[Dict[str, Any]] = [{"role": "system", "content": SYSTEM_PROMPT}]
-
-    def _dispatch(self, name: str, args: Dict[str, Any]) -> Dict[str, Any]:
+        # Conversation state lives server-side: each turn uploads only the items
+        # appended to self.messages since the last response it chains onto.
+        self._last_response_id: Optional[str] = None
+        self._sent = 0
+        # (tool name, canonical args JSON) -> (result, serialized result)
+        self._tool_json_cache: Dict[Tuple[str, str], Tuple[Dict[str, Any], str]] = {}
+
+    def _dispatch(self, name: str, args: Dict[str, Any]) -> Tuple[Dict[str, Any], str]:
+        """
+        Runs a tool and returns (result, result serialized for function_call_output).
+        Repeated calls to a CACHEABLE_TOOLS tool with the same args reuse both,
+        as long as the db is read-only.
+        """
+        key = None
+        if name in CACHEABLE_TOOLS and self.tooling.env.read_only:
+            key = (name, orjson.dumps(args, option=orjson.OPT_SORT_KEYS).decode())
+            cached = self._tool_json_cache.get(key)
+            if cached is not None:
+                return cached
+        result = self._run_tool(name, args)
+        out = (result, orjson.dumps(result).decode())
+        if key is not None:
+            self._tool_json_cache[key] = out
+        return out
+
+    def _run_tool(self, name: str, args: Dict[str, Any]) -> Dict[str, Any]:
         if name == "list_tables":
             return self.tooling.list_tables()
         if name == "table_exists":
@@ -49,9 +83,11 @@ class SQLAgent:
             return self.tooling.explain(**args)
         if name == "benchmark":
             return self.tooling.benchmark(**args)
+        if name == "benchmark_batch":
+            return self.tooling.benchmark_batch(**args)
         return {"ok": False, "error": f"Unknown tool: {name}", "name": name, "args": args}
 
-    def run_tool_loop(self) -> Tuple[Optional[str], List[Dict[str, Any]]]:
+    async def run_tool_loop(self) -> Tuple[Optional[str], List[Dict[str, Any]]]:
         """
         Executes model/tool loop until model returns a final text (no tool calls),
         or until max steps is reached.
@@ -59,10 +95,16 @@ class SQLAgent:
         """
         events: List[Dict[str, Any]] = []
         for _ in range(self.cfg.max_tool_steps):
-            resp = self.llm.responses_create(self.messages, tools=TOOLS_SPEC)
+            resp = await self.llm.responses_create(
+                self.messages[self._sent:],
+                tools=TOOLS_SPEC,
+                previous_response_id=self._last_response_id,
+            )
             output_items = resp.get("output", []) if isinstance(resp, dict) else resp.output
+            self._last_response_id = resp.get("id") if isinstance(resp, dict) else resp.id
 
             self.messages += output_items
+            self._sent = len(self.messages)
 
             tool_calls: List[Dict[str, Any]] = []
             final_text_chunks: List[str] = []
@@ -80,18 +122,34 @@ class SQLAgent:
                         final_text_chunks.append(content)
 
             if tool_calls:
+                parsed: List[Tuple[str, Dict[str, Any], Any]] = []
                 for call in tool_calls:
                     name = call.get("name")
                     args_str = call.get("arguments", "{}")
                     call_id = call.get("call_id") or call.get("id")
 
                     try:
-                        args = json.loads(args_str) if isinstance(args_str, str) else (args_str or {})
+                        args = orjson.loads(args_str) if isinstance(args_str, str) else (args_str or {})
                     except Exception:
                         args = {}
 
                     events.append({"kind": "tool_call", "name": name, "args": args})
-                    result = self._dispatch(name, args)
+                    parsed.append((name, args, call_id))
+
+                # Answer every call of this turn in one round-trip. Non-timing calls run
+                # together in worker threads; timing calls then run one at a time.
+                results: List[Any] = [None] * len(parsed)
+                concurrent = [i for i, (name, _, _) in enumerate(parsed) if name not in TIMING_TOOLS]
+                gathered = await asyncio.gather(
+                    *(asyncio.to_thread(self._dispatch, parsed[i][0], parsed[i][1]) for i in concurrent)
+                )
+                for i, res in zip(concurrent, gathered):
+                    results[i] = res
+                for i, (name, args, _) in enumerate(parsed):
+                    if name in TIMING_TOOLS:
+                        results[i] = await asyncio.to_thread(self._dispatch, name, args)
+
+                for (name, _, call_id), (result, output) in zip(parsed, results):
                     events.append({"kind": "tool_result", "name": name, "result": result})
 
                     # Feed tool output back
@@ -107,19 +165,30 @@ class SQLAgent:
                         {
                             "type": "function_call_output",
                             "call_id": call_id,
-                            "output": json.dumps(result, ensure_ascii=False),
+                            "output": output,
                         }
                     )
                 continue
 
+            # The model's message is already part of the chained conversation.
             final_text = "\n".join([t for t in final_text_chunks if t.strip()]).strip() or None
-            if final_text:
-                self.messages.append({"role": "assistant", "content": final_text})
             return final_text, events
 
         return "Stopped: reached max_tool_steps.", events
 
-    def optimize_once(
+    def add_prefetched_schema(self, schemas: Dict[str, Dict[str, Any]]) -> None:
+        """
+        Adds describe_relation results gathered outside the model loop, so the
+        model doesn't spend turns requesting them.
+        """
+        self.messages.append(
+            {
+                "role": "user",
+                "content": "Pre-fetched schema for referenced tables:\n" + orjson.dumps(schemas).decode(),
+            }
+        )
+
+    async def optimize_once(
         self,
         bad_sql: str,
         runs: int = 3,
@@ -134,7 +203,7 @@ class SQLAgent:
         - ask model for optimized SQL
         - candidate benchmark
         """
-        table_refs = extract_table_refs(bad_sql)
+        table_refs = list(extract_table_refs(bad_sql))
         self.messages.append(
             {
                 "role": "user",
@@ -155,11 +224,12 @@ class SQLAgent:
             {
                 "role": "user",
                 "content": (
-                    "Before rewriting, verify referenced relations and gather schema using tools. "
+                    "Before rewriting, verify referenced relations and gather schema using tools "
+                    "(skip relations whose schema was already pre-fetched). "
                     "Then benchmark the baseline. After rewriting, benchmark again."
                 ),
             }
         )
 
-        final_text, events = self.run_tool_loop()
+        final_text, events = await self.run_tool_loop()
         return {"final_text": final_text, "events": events, "table_refs": table_refs}
@@ -1,6 +1,9 @@
 from __future__ import annotations
+import asyncio
 from pathlib import Path
+import functools
 import re
+from typing import Any, Dict
 import typer
 from rich.console import Console
 from rich.panel import Panel
@@ -10,12 +13,14 @@ from rich.syntax import Syntax
 from .duckdb_tools import DuckDBTooling, DuckDBEnv
 from .llm_openai import OpenAIResponsesLLM, LLMConfig
 from .agent import SQLAgent, AgentConfig
+from .util import extract_table_refs, normalize_sql
 
 app = typer.Typer(add_completion=False)
 console = Console()
 
 SQL_BLOCK_RE = re.compile(r"```sql\s*(.*?)```", re.DOTALL | re.IGNORECASE)
 
+@functools.lru_cache(maxsize=64)
 def _extract_sql_from_model(text: str) -> str | None:
     if not text:
         return None
@@ -34,7 +39,8 @@ def optimize(
     query: str = typer.Option(None, help="Bad SQL query as a string"),
     model: str = typer.Option("gpt-4o-mini", help="OpenAI model"),
     runs: int = typer.Option(3, help="Benchmark runs (median)"),
-    warmup: int = typer.Option(1, help="Warmup runs"),
+    warmup: int = typer.Option(1, help="Warmup runs (skipped for SQL already run in this session)"),
+    no_warmup: bool = typer.Option(False, "--no-warmup", help="Skip warmup runs entirely"),
     timeout_s: int = typer.Option(60, help="Timeout for EXPLAIN ANALYZE (best-effort)"),
     max_iters: int = typer.Option(2, help="Max optimization iterations"),
     min_improve_pct: float = typer.Option(10.0, help="Stop if improvement >= this percent"),
@@ -53,73 +59,121 @@ def optimize(
     else:
         bad_sql = query
 
+    if no_warmup:
+        warmup = 0
+
+    asyncio.run(
+        _optimize(
+            db,
+            bad_sql,
+            model=model,
+            runs=runs,
+            warmup=warmup,
+            timeout_s=timeout_s,
+            max_iters=max_iters,
+            min_improve_pct=min_improve_pct,
+        )
+    )
+
+async def _optimize(
+    db: str,
+    bad_sql: str,
+    model: str,
+    runs: int,
+    warmup: int,
+    timeout_s: int,
+    max_iters: int,
+    min_improve_pct: float,
+) -> None:
+    """
+    The optimize loop. DuckDB calls run in worker threads, off the event loop;
+    the catalog/explain calls of one model turn run concurrently with each other.
+    """
     tooling = DuckDBTooling(DuckDBEnv(db_path=db, read_only=True))
     llm = OpenAIResponsesLLM(LLMConfig(model=model, max_output_tokens=1400))
     agent = SQLAgent(llm, tooling, AgentConfig(max_tool_steps=35))
 
-    console.print(Panel.fit(f"[bold]qagent[/bold]\nDB: {db}\nModel: {model}", title="SQL Optimizer Agent (MVP)"))
-    console.print(Panel(Syntax(bad_sql, "sql", word_wrap=True), title="Input SQL", border_style="cyan"))
+    try:
+        console.print(Panel.fit(f"[bold]qagent[/bold]\nDB: {db}\nModel: {model}", title="SQL Optimizer Agent (MVP)"))
+        console.print(Panel(Syntax(bad_sql, "sql", word_wrap=True), title="Input SQL", border_style="cyan"))
 
-    best_sql = bad_sql
-    best_report = None
+        best_sql = bad_sql
+        best_report = None
 
-    # Baseline benchmark done directly (outside LLM) for a stable numeric reference
-    base_bench = tooling.benchmark(best_sql, runs=runs, warmup=warmup, timeout_s=timeout_s)
-    if not base_bench.get("ok"):
-        console.print(Panel(str(base_bench), title="Baseline benchmark failed", border_style="red"))
-        raise typer.Exit(code=1)
+        # Benchmarks by normalized SQL, so a candidate identical to an earlier query isn't re-run
+        bench_cache: Dict[str, Dict[str, Any]] = {}
 
-    base_ms = float(base_bench["median_ms"])
-    console.print(Panel(Pretty(base_bench), title=f"Baseline benchmark (median_ms={base_ms:.2f})", border_style="green"))
+        def bench(sql: str) -> Dict[str, Any]:
+            key = normalize_sql(sql)
+            if key not in bench_cache:
+                bench_cache[key] = tooling.benchmark(sql, runs=runs, warmup=warmup, timeout_s=timeout_s)
+            return bench_cache[key]
 
-    for it in range(1, max_iters + 1):
-        console.print(Panel.fit(f"Iteration {it}/{max_iters}", border_style="yellow"))
+        def prefetch_schema() -> Dict[str, Dict[str, Any]]:
+            return {name: tooling.describe_relation(name) for name in extract_table_refs(bad_sql)}
 
-        out = agent.optimize_once(
-            best_sql,
-            runs=runs,
-            warmup=warmup,
-            timeout_s=timeout_s,
-            allow_semantic_change=False,
-        )
+        # Baseline benchmark done directly (outside LLM) for a stable numeric reference
+        base_bench = await asyncio.to_thread(bench, best_sql)
+        if not base_bench.get("ok"):
+            console.print(Panel(str(base_bench), title="Baseline benchmark failed", border_style="red"))
+            raise typer.Exit(code=1)
 
-        final_text = out.get("final_text") or ""
-        console.print(Panel(final_text or "(no text)", title="Model output", border_style="cyan"))
+        # Hand the model the schema it would otherwise ask for (catalog lookups are in-memory)
+        agent.add_prefetched_schema(prefetch_schema())
 
-        cand_sql = _extract_sql_from_model(final_text)
-        if not cand_sql:
-            console.print(Panel("No SQL block found in model output. Stopping.", border_style="red"))
-            break
+        base_ms = float(base_bench["median_ms"])
+        console.print(Panel(Pretty(base_bench), title=f"Baseline benchmark (median_ms={base_ms:.2f})", border_style="green"))
 
-        console.print(Panel(Syntax(cand_sql, "sql", word_wrap=True), title="Candidate SQL", border_style="cyan"))
+        for it in range(1, max_iters + 1):
+            console.print(Panel.fit(f"Iteration {it}/{max_iters}", border_style="yellow"))
 
-        cand_bench = tooling.benchmark(cand_sql, runs=runs, warmup=warmup, timeout_s=timeout_s)
-        if not cand_bench.get("ok"):
-            console.print(Panel(Pretty(cand_bench), title="Candidate benchmark failed", border_style="red"))
-            # Keep best, but allow another iteration if model can try a different approach
-            continue
+            out = await agent.optimize_once(
+                best_sql,
+                runs=runs,
+                warmup=warmup,
+                timeout_s=timeout_s,
+                allow_semantic_change=False,
+            )
 
-        cand_ms = float(cand_bench["median_ms"])
-        improve_pct = (base_ms - cand_ms) / base_ms * 100.0
+            final_text = out.get("final_text") or ""
+            console.print(Panel(final_text or "(no text)", title="Model output", border_style="cyan"))
 
-        console.print(
-            Panel(
-                Pretty(cand_bench),
-                title=f"Candidate benchmark (median_ms={cand_ms:.2f}, improve={improve_pct:.1f}%)",
-                border_style="green" if improve_pct > 0 else "red",
-            )
-        )
+            cand_sql = _extract_sql_from_model(final_text)
+            if not cand_sql:
+                console.print(Panel("No SQL block found in model output. Stopping.", border_style="red"))
+                break
 
-        if cand_ms < base_ms:
-            # update baseline reference to new best for subsequent iteration
-            best_sql = cand_sql
-            base_ms = cand_ms
-            best_report = {"benchmark": cand_bench, "model_text": final_text, "improve_pct": improve_pct}
+            console.print(Panel(Syntax(cand_sql, "sql", word_wrap=True), title="Candidate SQL", border_style="cyan"))
 
-        if improve_pct >= min_improve_pct:
-            console.print(Panel.fit(f"Reached improvement threshold: {improve_pct:.1f}% ≥ {min_improve_pct:.1f}%. Stopping.", border_style="green"))
-            break
+            cand_bench = await asyncio.to_thread(bench, cand_sql)
+            if not cand_bench.get("ok"):
+                console.print(Panel(Pretty(cand_bench), title="Candidate benchmark failed", border_style="red"))
+                # Keep best, but allow another iteration if model can try a different approach
+                continue
+
+            cand_ms = float(cand_bench["median_ms"])
+            improve_pct = (base_ms - cand_ms) / base_ms * 100.0
+
+            console.print(
+                Panel(
+                    Pretty(cand_bench),
+                    title=f"Candidate benchmark (median_ms={cand_ms:.2f}, improve={improve_pct:.1f}%)",
+                    border_style="green" if improve_pct > 0 else "red",
+                )
+            )
 
-    console.print(Panel(Syntax(best_sql, "sql", word_wrap=True), title="Best SQL (final)", border_style="magenta"))
-    if best_report:
-        console.print(Panel(Pretty(best_report), title="Best report", border_style="magenta"))
+            if cand_ms < base_ms:
+                # update baseline reference to new best for subsequent iteration
+                best_sql = cand_sql
+                base_ms = cand_ms
+                best_report = {"benchmark": cand_bench, "model_text": final_text, "improve_pct": improve_pct}
+
+            if improve_pct >= min_improve_pct:
+                console.print(Panel.fit(f"Reached improvement threshold: {improve_pct:.1f}% ≥ {min_improve_pct:.1f}%. Stopping.", border_style="green"))
+                break
+
+        console.print(Panel(Syntax(best_sql, "sql", word_wrap=True), title="Best SQL (final)", border_style="magenta"))
+        if best_report:
+            console.print(Panel(Pretty(best_report), title="Best report", border_style="magenta"))
+    finally:
+        await llm.aclose()
@@ -3,12 +3,27 @@
 from __future__ import annotations
 import time
 import re
+import statistics
+import threading
 from dataclasses import dataclass
-from typing import Any, Dict, List, Optional, Tuple
+from typing import Any, Dict, List, Optional, Set, Tuple
 
 import duckdb
 
+from .util import normalize_sql, truncate_middle
+
 TOTAL_TIME_RE = re.compile(r"Total Time:\s*([0-9.]+)s", re.IGNORECASE)
+# analyze_sample is sent back to the model; the top operators and Total Time are what matter
+ANALYZE_SAMPLE_MAX_CHARS = 4096
+# Candidates per benchmark_batch call (the prompt and tool schema promise "up to 4")
+BENCHMARK_BATCH_MAX = 4
+
+# (tables as (schema, name, type), columns by (schema, table), schemas by table name)
+Catalog = Tuple[
+    List[Tuple[str, str, str]],
+    Dict[Tuple[str, str], List[Tuple[str, str]]],
+    Dict[str, List[str]],
+]
 
 @dataclass
 class DuckDBEnv:
@@ -20,65 +35,110 @@ class DuckDBTooling:
         self.env = env
         # read_only=True prevents accidental writes to the db file
         self.con = duckdb.connect(database=env.db_path, read_only=env.read_only)
+        # Tool calls from one model turn may run on several threads; each thread
+        # gets its own cursor on the shared database (see _cursor).
+        self._local = threading.local()
+        self._configure(self.con)
+        # Concurrent queries compete for the same cores, so benchmarks take turns
+        # to keep their timings comparable; catalog and explain calls don't need to.
+        self._bench_lock = threading.Lock()
+
+        # Normalized SQL already run on this database; caches are warm for these,
+        # so benchmark skips their warmup.
+        self._primed: Set[str] = set()
+
+        # Catalog snapshot: a read-only db can't change under the tools, so catalog
+        # lookups are answered from memory instead of querying information_schema
+        # per call. A writable db is read live, since benchmark/explain run
+        # arbitrary SQL and a CREATE/DROP would leave a snapshot stale.
+        self._snapshot: Optional[Catalog] = (
+            self._read_catalog(self.con) if env.read_only else None
+        )
 
-        # Make EXPLAIN output stable/readable
+    def _configure(self, con: duckdb.DuckDBPyConnection) -> None:
+        # Make EXPLAIN output stable/readable. explain_output is LOCAL (session)
+        # scope in duckdb_settings(): a cursor doesn't inherit it from self.con.
         try:
-            self.con.execute("SET explain_output='all';")
+            con.execute("SET explain_output='all';")
         except Exception:
             pass
 
-    # ---------- basic catalog ----------
-    def list_tables(self) -> Dict[str, Any]:
-        rows = self.con.execute(
+    def _cursor(self) -> duckdb.DuckDBPyConnection:
+        cur = getattr(self._local, "cur", None)
+        if cur is None:
+            cur = self.con.cursor()
+            self._configure(cur)
+            self._local.cur = cur
+        return cur
+
+    def _catalog(self) -> Catalog:
+        if self._snapshot is not None:
+            return self._snapshot
+        return self._read_catalog(self._cursor())
+
+    @staticmethod
+    def _read_catalog(con: duckdb.DuckDBPyConnection) -> Catalog:
+        tables = [
+            (r[0], r[1], r[2])
+            for r in con.execute(
+                """
+                SELECT table_schema, table_name, table_type
+                FROM information_schema.tables
+                ORDER BY table_schema, table_name
+                """
+            ).fetchall()
+        ]
+        rows = con.execute(
             """
-            SELECT table_schema, table_name, table_type
-            FROM information_schema.tables
-            WHERE table_schema NOT IN ('information_schema', 'pg_catalog')
-            ORDER BY table_schema, table_name
+            SELECT table_schema, table_name, column_name, data_type, ordinal_position
+            FROM information_schema.columns
+            ORDER BY table_schema, table_name, ordinal_position
             """
         ).fetchall()
-        items = [{"schema": r[0], "name": r[1], "type": r[2]} for r in rows]
+        columns: Dict[Tuple[str, str], List[Tuple[str, str]]] = {}
+        for schema, table, col, typ, _ in rows:
+            columns.setdefault((schema, table), []).append((col, typ))
+        schemas_by_table: Dict[str, List[str]] = {}
+        for schema, table, _ in tables:
+            schemas_by_table.setdefault(table, []).append(schema)
+        return tables, columns, schemas_by_table
+
+    # ---------- basic catalog ----------
+    def list_tables(self) -> Dict[str, Any]:
+        tables, _, _ = self._catalog()
+        items = [
+            {"schema": schema, "name": name, "type": typ}
+            for (schema, name, typ) in tables
+            if schema not in ("information_schema", "pg_catalog")
+        ]
         return {"ok": True, "tables": items}
 
     def table_exists(self, name: str) -> Dict[str, Any]:
         # Accept schema.table or table
+        _, _, schemas_by_table = self._catalog()
         if "." in name:
             schema, table = name.split(".", 1)
-            q = """
-            SELECT COUNT(*) FROM information_schema.tables
-            WHERE table_schema=? AND table_name=?
-            """
-            n = self.con.execute(q, [schema, table]).fetchone()[0]
+            exists = schema in schemas_by_table.get(table, ())
         else:
-            q = """
-            SELECT COUNT(*) FROM information_schema.tables
-            WHERE table_name=?
-            """
-            n = self.con.execute(q, [name]).fetchone()[0]
-        return {"ok": True, "name": name, "exists": n > 0}
+            exists = name in schemas_by_table
+        return {"ok": True, "name": name, "exists": exists}
 
     def describe_relation(self, name: str, sample_cols: int = 200) -> Dict[str, Any]:
         """
-        Returns columns/types from information_schema.columns.
+        Returns columns/types from information_schema.columns (the snapshot, for a
+        read-only db).
         """
+        _, columns, schemas_by_table = self._catalog()
         if "." in name:
             schema, table = name.split(".", 1)
-            q = """
-            SELECT column_name, data_type
-            FROM information_schema.columns
-            WHERE table_schema=? AND table_name=?
-            ORDER BY ordinal_position
-            """
-            rows = self.con.execute(q, [schema, table]).fetchall()
+            rows = columns.get((schema, table), [])
         else:
             # could match multiple schemas; pick all
-            q = """
-            SELECT table_schema, column_name, data_type
-            FROM information_schema.columns
-            WHERE table_name=?
-            ORDER BY table_schema, ordinal_position
-            """
-            rows = self.con.execute(q, [name]).fetchall()
+            rows = [
+                (schema, c, t)
+                for schema in schemas_by_table.get(name, [])
+                for (c, t) in columns.get((schema, name), [])
+            ]
 
         if not rows:
             return {"ok": False, "error": f"Relation not found in catalog: {name}"}
@@ -103,7 +163,7 @@ class DuckDBTooling:
     # ---------- explain / eval ----------
     def explain(self, sql: str) -> Dict[str, Any]:
         try:
-            rows = self.con.execute(f"EXPLAIN {sql}").fetchall()
+            rows = self._cursor().execute(f"EXPLAIN {sql}").fetchall()
             # DuckDB returns rows like (explain_key, explain_value)
             plan = "\n".join([str(r[1]) for r in rows])
             return {"ok": True, "plan": plan}
@@ -119,7 +179,7 @@ class DuckDBTooling:
             # DuckDB doesn't offer a built-in statement timeout consistently across versions;
             # we enforce via Python-level timeout by measuring and returning if too slow.
             t0 = time.perf_counter()
-            rows = self.con.execute(f"EXPLAIN ANALYZE {sql}").fetchall()
+            rows = self._cursor().execute(f"EXPLAIN ANALYZE {sql}").fetchall()
             elapsed = (time.perf_counter() - t0) * 1000.0
 
             txt = "\n".join([str(r[1]) for r in rows])
@@ -136,31 +196,57 @@ class DuckDBTooling:
         except Exception as e:
             return {"ok": False, "error": f"EXPLAIN ANALYZE failed: {e}"}
 
-    def benchmark(self, sql: str, runs: int = 3, warmup: int = 1, timeout_s: int = 60) -> Dict[str, Any]:
+    def benchmark(
+        self,
+        sql: str,
+        runs: int = 3,
+        warmup: int = 1,
+        timeout_s: int = 60,
+        include_analyze: bool = True,
+    ) -> Dict[str, Any]:
         """
-        Benchmarks using EXPLAIN ANALYZE as the measurement primitive.
-        Returns median of client-measured elapsed ms, and captures one analyze text.
+        Binds the query once and times repeated executions of the bound relation.
+        Returns median of client-measured elapsed ms, and (if include_analyze)
+        one analyze text capped at ANALYZE_SAMPLE_MAX_CHARS.
+        Warmup is skipped for SQL that already ran on this database.
         """
         times = []
         last_analyze = None
         last_total_s = None
+        if runs < 1:
+            return {"ok": False, "error": "benchmark failed: runs must be >= 1"}
+        key = normalize_sql(sql)
+        if key in self._primed:
+            warmup = 0
 
-        # warmup
-        for _ in range(warmup):
-            r = self.explain_analyze(sql, timeout_s=timeout_s)
-            if not r.get("ok"):
-                return {"ok": False, "error": r.get("error")}
-        # measured
-        for _ in range(runs):
-            r = self.explain_analyze(sql, timeout_s=timeout_s)
-            if not r.get("ok"):
-                return {"ok": False, "error": r.get("error")}
-            times.append(float(r["elapsed_ms_client"]))
-            last_analyze = r.get("analyze")
-            last_total_s = r.get("total_time_s_explain")
-
-        times_sorted = sorted(times)
-        median = times_sorted[len(times_sorted) // 2]
+        with self._bench_lock:
+            try:
+                # Parsed/bound once; execute() runs the query to completion inside
+                # DuckDB without converting the result set to Python objects.
+                rel = self._cursor().sql(sql)
+                if rel is None:
+                    return {"ok": False, "error": "benchmark failed: statement returns no result set"}
+                # warmup
+                for _ in range(warmup):
+                    rel.execute()
+                # measured
+                for _ in range(runs):
+                    t0 = time.perf_counter_ns()
+                    rel.execute()
+                    times.append((time.perf_counter_ns() - t0) / 1e6)
+            except Exception as e:
+                return {"ok": False, "error": f"benchmark failed: {e}"}
+            self._primed.add(key)
+
+            # The analyze sample executes the query too, so it stays inside the lock.
+            if include_analyze:
+                r = self.explain_analyze(sql, timeout_s=timeout_s)
+                if not r.get("ok"):
+                    return {"ok": False, "error": r.get("error")}
+                last_analyze = truncate_middle(r.get("analyze") or "", ANALYZE_SAMPLE_MAX_CHARS)
+                last_total_s = r.get("total_time_s_explain")
+
+        median = statistics.median(times)
         return {
             "ok": True,
             "runs": runs,
@@ -171,11 +257,47 @@ class DuckDBTooling:
             "total_time_s_explain_sample": last_total_s,
         }
 
+    def benchmark_batch(
+        self,
+        sqls: List[str],
+        runs: int = 3,
+        warmup: int = 1,
+        timeout_s: int = 60,
+        include_analyze: bool = False,
+    ) -> Dict[str, Any]:
+        """
+        Benchmarks several candidate queries in one call. Warmup runs once, on the
+        first query, and warms the caches the candidates share; every query then
+        gets `runs` timed executions. Results are per query, in input order.
+        """
+        if not isinstance(sqls, list) or not all(isinstance(q, str) for q in sqls):
+            return {"ok": False, "error": "benchmark_batch needs `sqls` as a list of SQL strings"}
+        if not sqls:
+            return {"ok": False, "error": "benchmark_batch needs at least one SQL"}
+        if len(sqls) > BENCHMARK_BATCH_MAX:
+            return {"ok": False, "error": f"benchmark_batch accepts at most {BENCHMARK_BATCH_MAX} queries, got {len(sqls)}"}
+        results = [
+            self.benchmark(
+                sql,
+                runs=runs,
+                warmup=warmup if i == 0 else 0,
+                timeout_s=timeout_s,
+                include_analyze=include_analyze,
+            )
+            for i, sql in enumerate(sqls)
+        ]
+        timed = [(r["median_ms"], i) for i, r in enumerate(results) if r.get("ok")]
+        return {
+            "ok": True,
+            "results": results,
+            "fastest_index": min(timed)[1] if timed else None,
+        }
+
     # ---------- helpers ----------
     def _timed_exec_scalar(self, sql: str, timeout_s: int, label: str) -> Dict[str, Any]:
         try:
             t0 = time.perf_counter()
-            val = self.con.execute(sql).fetchone()[0]
+            val = self._cursor().execute(sql).fetchone()[0]
             elapsed = (time.perf_counter() - t0) * 1000.0
             if elapsed > timeout_s * 1000:
                 return {"ok": False, "error": f"{label} exceeded timeout {timeout_s}s", "elapsed_ms": elapsed}
@@ -233,7 +355,7 @@ TOOLS_SPEC = [
     {
         "type": "function",
         "name": "benchmark",
-        "description": "Benchmark a SQL query using EXPLAIN ANALYZE. IMPORTANT: `sql` must be raw SQL only (no markdown, no backticks, no headings).",
+        "description": "Benchmark a SQL query (median of repeated executions) and return one EXPLAIN ANALYZE sample. IMPORTANT: `sql` must be raw SQL only (no markdown, no backticks, no headings).",
         "parameters": {
             "type": "object",
             "properties": {
@@ -241,8 +363,33 @@ TOOLS_SPEC = [
                 "runs": {"type": "integer", "default": 3},
                 "warmup": {"type": "integer", "default": 1},
                 "timeout_s": {"type": "integer", "default": 60},
+                "include_analyze": {
+                    "type": "boolean",
+                    "default": True,
+                    "description": "Set false to skip the EXPLAIN ANALYZE sample when only timings are needed.",
+                },
             },
             "required": ["sql"],
             },
     },
+    {
+        "type": "function",
+        "name": "benchmark_batch",
+        "description": "Benchmark several candidate SQL queries in one call (shared warmup, then median per query). Each entry of `sqls` must be raw SQL only.",
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "sqls": {"type": "array", "items": {"type": "string"}, "maxItems": BENCHMARK_BATCH_MAX},
+                "runs": {"type": "integer", "default": 3},
+                "warmup": {"type": "integer", "default": 1},
+                "timeout_s": {"type": "integer", "default": 60},
+                "include_analyze": {
+                    "type": "boolean",
+                    "default": False,
+                    "description": "Set true to also get an EXPLAIN ANALYZE sample for every query.",
+                },
+            },
+            "required": ["sqls"],
+            },
+    },
 ]
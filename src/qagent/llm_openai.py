@@ -1,26 +1,64 @@
 # llm openai.py
 from __future__ import annotations
 from dataclasses import dataclass
-from typing import Any, Dict, List
-from openai import OpenAI
+from typing import Any, Dict, List, Optional
+import httpx
+from openai import DEFAULT_CONNECTION_LIMITS, AsyncOpenAI, DefaultAsyncHttpxClient
 
 @dataclass
 class LLMConfig:
     model: str = "gpt-5"  
     max_output_tokens: int = 1200
+    # Let the model request several tools per turn, answered in one round-trip. The agent
+    # runs catalog/explain calls concurrently but benchmarks one at a time.
+    parallel_tool_calls: bool = True
+    # Custom HTTP client; by default a persistent HTTP/2 client (see _default_http_client)
+    http_client: Optional[httpx.AsyncClient] = None
+
+def _default_http_client() -> httpx.AsyncClient:
+    # Tool execution between model turns often outlasts the SDK's 5s keepalive,
+    # which would cost a new TCP/TLS handshake per turn; keep connections longer.
+    # DefaultAsyncHttpxClient keeps the SDK's other defaults (timeouts, redirects).
+    return DefaultAsyncHttpxClient(
+        http2=True,
+        limits=httpx.Limits(
+            max_connections=DEFAULT_CONNECTION_LIMITS.max_connections,
+            max_keepalive_connections=8,
+            keepalive_expiry=60.0,
+        ),
+    )
 
 class OpenAIResponsesLLM:
     def __init__(self, cfg: LLMConfig):
         self.cfg = cfg
-        self.client = OpenAI()
+        # Only close the HTTP client in aclose() if we created it.
+        self._owns_http_client = cfg.http_client is None
+        self.client = AsyncOpenAI(http_client=cfg.http_client or _default_http_client())
+
+    async def aclose(self) -> None:
+        if self._owns_http_client:
+            await self.client.close()
 
-    def responses_create(self, input_messages: List[Dict[str, Any]], tools: List[Dict[str, Any]]) -> Dict[str, Any]:
-        resp = self.client.responses.create(
+    async def responses_create(
+        self,
+        input_messages: List[Dict[str, Any]],
+        tools: List[Dict[str, Any]],
+        previous_response_id: Optional[str] = None,
+    ) -> Dict[str, Any]:
+        """
+        With previous_response_id, the server resumes that conversation and
+        input_messages only needs the items added since.
+        """
+        kwargs: Dict[str, Any] = {}
+        if previous_response_id:
+            kwargs["previous_response_id"] = previous_response_id
+        resp = await self.client.responses.create(
             model=self.cfg.model,
             input=input_messages,
             tools=tools,
             max_output_tokens=self.cfg.max_output_tokens,
-            parallel_tool_calls=False,
+            parallel_tool_calls=self.cfg.parallel_tool_calls,
+            **kwargs,
         )
         try:
             return resp.model_dump()
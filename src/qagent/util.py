@@ -1,10 +1,19 @@
 from __future__ import annotations
+import functools
 import re
-from typing import List
+from typing import Dict, List, Tuple
+
+import sqlglot
+from sqlglot import exp
+
+try:
+    import hyperscan
+except ImportError:  # optional, see the `fast` extra
+    hyperscan = None
 
 TABLE_REGEX = re.compile(
     r"""
-    (?:
+    \b(?:
       from|join
     )\s+
     (?:
@@ -15,25 +24,107 @@ TABLE_REGEX = re.compile(
     re.IGNORECASE | re.VERBOSE,
 )
 
-def extract_table_refs(sql: str) -> List[str]:
-    """
-    MVP table ref extractor: finds FROM/JOIN identifiers like schema.table or table.
-    Limitations: won't catch quoted identifiers, subqueries with aliases, etc.
-    Good enough for MVP prompting + follow-up questions.
-    """
+# Same pattern for Hyperscan (no capture groups there; refs are sliced from match offsets).
+# The trailing \b limits match reports to identifier ends. Hyperscan's \w is
+# ASCII-only, so non-ASCII identifier characters end a match early.
+HS_TABLE_PATTERN = rb"\b(?:from|join)\s+[A-Za-z_]\w*(?:\.[A-Za-z_]\w*)?\b"
+
+def _compile_hs_table_db():
+    if hyperscan is None:
+        return None
+    try:
+        db = hyperscan.Database()
+        db.compile(
+            expressions=[HS_TABLE_PATTERN],
+            ids=[0],
+            elements=1,
+            flags=[hyperscan.HS_FLAG_CASELESS | hyperscan.HS_FLAG_SOM_LEFTMOST],
+        )
+        return db
+    except Exception:
+        return None
+
+HS_TABLE_DB = _compile_hs_table_db()
+
+def _scan_table_refs_hs(sql: str) -> List[str]:
+    data = sql.encode("utf-8")
+    # Hyperscan reports every end offset of every match; keep the longest per start.
+    ends: Dict[int, int] = {}
+
+    def on_match(_id: int, start: int, end: int, _flags: int, _ctx) -> None:
+        if end > ends.get(start, -1):
+            ends[start] = end
+
+    HS_TABLE_DB.scan(data, match_event_handler=on_match)
+
+    refs = []
+    last_end = 0
+    for start in sorted(ends):
+        # skip matches overlapping the previous one, like re.finditer
+        if start < last_end:
+            continue
+        last_end = ends[start]
+        refs.append(data[start:last_end].decode("utf-8").split(None, 1)[1])
+    return refs
+
+def _scan_table_refs(sql: str) -> List[str]:
+    if HS_TABLE_DB is not None:
+        return _scan_table_refs_hs(sql)
     refs = []
     for m in TABLE_REGEX.finditer(sql):
         schema = m.group("schema")
         table = m.group("table")
         refs.append(f"{schema}.{table}" if schema else table)
-    # de-dup preserve order
-    seen = set()
-    out = []
-    for r in refs:
-        if r not in seen:
-            seen.add(r)
-            out.append(r)
-    return out
+    return refs
+
+def _parse_table_refs(sql: str) -> List[str]:
+    tables = []
+    for stmt in sqlglot.parse(sql, read="duckdb"):
+        if stmt is None:
+            continue
+        ctes = {cte.alias_or_name for cte in stmt.find_all(exp.CTE)}
+        for t in stmt.find_all(exp.Table):
+            # table functions (range(), read_parquet(), ...) aren't catalog relations
+            if not isinstance(t.this, exp.Identifier):
+                continue
+            if not t.db and t.name in ctes:
+                continue
+            tables.append(t)
+    # find_all walks the tree; report refs in the order they appear in the text
+    tables.sort(key=lambda t: t.this.meta.get("start", 0))
+    return [f"{t.db}.{t.name}" if t.db else t.name for t in tables]
+
+@functools.lru_cache(maxsize=128)
+def extract_table_refs(sql: str) -> Tuple[str, ...]:
+    """
+    Table ref extractor: returns referenced relations as schema.table or table,
+    de-duplicated in order of appearance. Parses with sqlglot, so quoted
+    identifiers are handled and CTE names are not reported.
+    SQL that sqlglot can't parse falls back to a FROM/JOIN scan (Hyperscan when
+    installed, else re), which misses quoted identifiers.
+    Memoized on the SQL text, so the result is an immutable tuple.
+    """
+    try:
+        refs = _parse_table_refs(sql)
+    except sqlglot.errors.SqlglotError:
+        refs = _scan_table_refs(sql)
+    return tuple(dict.fromkeys(refs))
+
+def normalize_sql(sql: str) -> str:
+    """
+    Whitespace-insensitive key for a query: trims, drops trailing semicolons and
+    collapses whitespace runs. Case is kept since it matters inside literals.
+    """
+    return re.sub(r"\s+", " ", sql.strip().rstrip(";").strip())
+
+def truncate_middle(text: str, limit: int) -> str:
+    """
+    Keeps the head and tail of text within ~limit chars, eliding the middle.
+    """
+    if len(text) <= limit:
+        return text
+    half = limit // 2
+    return text[:half] + "\n...\n" + text[-half:]
 
 def clamp(n: int, lo: int, hi: int) -> int:
     return max(lo, min(hi, n))
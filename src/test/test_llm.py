@@ -1,3 +1,5 @@
+import asyncio
+
 from llm_openai import OpenAIResponsesLLM, LLMConfig   
 
 cfg = LLMConfig(
@@ -16,7 +18,7 @@ messages = [
 
 tools = []  
 
-resp = llm.responses_create(messages, tools)
+resp = asyncio.run(llm.responses_create(messages, tools))
 
 print("===== RESPONSE =====")
 print(resp)
\ No newline at end of file